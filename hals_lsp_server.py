@@ -9,22 +9,260 @@ flight software.
 Based on the NASA HAL/S Language Specification (1974-1978)
 """
 
+import hashlib
 import json
+from bisect import bisect_left
+from collections import OrderedDict
+import queue
 import sys
-import re
-from typing import Dict, List, Optional, Any
+import threading
+from json.encoder import encode_basestring_ascii
+from typing import Dict, List, Optional, Any, Tuple, Callable
 
 from hals_semantic_parser import HALSParser, SymbolKind
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Seconds of typing idle time before the background parser picks up
+# changed documents and publishes their diagnostics. Requests never wait
+# on this: they parse on demand and share the result through the cache
+DIAGNOSTICS_DEBOUNCE = 0.3
+
+# Number of recent completion/hover/definition/references results kept
+QUERY_CACHE_SIZE = 256
+
+# Number of documents whose parse is kept; less recently used documents
+# keep their text but are reparsed on their next request
+PARSE_CACHE_SIZE = 64
+
+# Parser symbol kind -> LSP CompletionItemKind
+_COMPLETION_KIND = {
+    'keyword': 14,      # Keyword
+    'program': 2,       # Module
+    'procedure': 3,     # Function
+    'function': 3,      # Function
+    'task': 2,          # Module
+    'compool': 2,       # Module
+    'variable': 6,      # Variable
+    'constant': 21,     # Constant
+    'structure': 22,    # Struct
+    'label': 20,        # Reference
+    'replace': 15,      # Snippet
+    'parameter': 6,     # Variable
+}
+
+# Parser symbol kind -> LSP SymbolKind
+_SYMBOL_KIND = {
+    'program': 2,       # Module
+    'procedure': 12,    # Function
+    'function': 12,     # Function
+    'task': 2,          # Module
+    'compool': 2,       # Module
+    'variable': 13,     # Variable
+    'constant': 14,     # Constant
+    'structure': 23,    # Struct
+    'label': 20,        # Key
+    'replace': 15,      # Macro
+    'parameter': 13,    # Variable
+}
+
+# Pre-encoded envelope heads for the notifications this server sends; the
+# params object and a closing brace complete the message
+_NOTIFICATION_PREFIX = {
+    method: b'{"jsonrpc":"2.0","method":"%s","params":' % method.encode('ascii')
+    for method in ('textDocument/publishDiagnostics', 'window/logMessage')
+}
+
+# Result of the initialize request; the same for every session
+_INIT_RESULT = {
+    'capabilities': {
+        'textDocumentSync': {
+            'openClose': True,
+            'change': 2,  # Incremental sync
+            'save': {'includeText': True}
+        },
+        'completionProvider': {
+            'triggerCharacters': ['.', ':', ' '],
+            'resolveProvider': False
+        },
+        'hoverProvider': True,
+        'definitionProvider': True,
+        'referencesProvider': True,
+        'documentSymbolProvider': True,
+    },
+    'serverInfo': {
+        'name': 'HAL/S Language Server',
+        'version': '1.0.0'
+    }
+}
+
+
+def _make_range(line: int, start: int, end: int) -> Dict:
+    """Build an LSP Range on a single line"""
+    return {
+        'start': {'line': line, 'character': start},
+        'end': {'line': line, 'character': end}
+    }
+
+
+def _content_hash(text: str) -> bytes:
+    """Digest of a document's text, used to tell whether it needs reparsing"""
+    data = text.encode('utf-8', 'surrogatepass')
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _line_index(line_text: str, character: int) -> int:
+    """
+    Convert an LSP character (UTF-16 code units) to an index into line_text.
+
+    A character past the end of the line stays as far past it.
+    """
+    if line_text.isascii():
+        return character
+    units = 0
+    for index, ch in enumerate(line_text):
+        if units >= character:
+            return index
+        # Characters outside the BMP are a surrogate pair in UTF-16
+        units += 2 if ord(ch) > 0xFFFF else 1
+    return len(line_text) + character - units
+
+
+def _word_prefix(line_text: str, end: int) -> str:
+    """Upper-cased identifier characters immediately before column end"""
+    end = min(end, len(line_text))
+    start = end
+    while start > 0 and (line_text[start - 1].isalnum() or line_text[start - 1] == '_'):
+        start -= 1
+    return line_text[start:end].upper()
+
+
+class _RawJSON(bytes):
+    """Already-encoded JSON, spliced into an outgoing message as-is"""
+
+
+def _json_str(value: str) -> bytes:
+    """Encode a string as a JSON string literal"""
+    return encode_basestring_ascii(value).encode('ascii')
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Encode a JSON-RPC message to UTF-8 bytes"""
+    if isinstance(obj, _RawJSON):
+        return obj
+    if orjson is not None:
+        return orjson.dumps(obj)
+    if isinstance(obj, dict):
+        # Walk envelope dicts by hand so pre-encoded payloads can be spliced in
+        return b'{' + b','.join(_json_str(key) + b':' + _json_dumps(value)
+                                for key, value in obj.items()) + b'}'
+    return json.dumps(obj).encode('utf-8')
+
+
+def _json_loads(data: bytes) -> Any:
+    """Decode a JSON-RPC message body"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+_DIAGNOSTIC_JSON = (b'{"range":{"start":{"line":%d,"character":%d},'
+                    b'"end":{"line":%d,"character":%d}},"message":%s,"severity":%d}')
+
+
+def _encode_diagnostics(diagnostics: List) -> _RawJSON:
+    """Encode parser diagnostics straight to an LSP Diagnostic[] array"""
+    template = _DIAGNOSTIC_JSON
+    return _RawJSON(b'[' + b','.join([
+        template % (diag.line, diag.column, diag.line, diag.end_column,
+                    _json_str(diag.message), 1 if diag.severity == 'error' else 2)
+        for diag in diagnostics
+    ]) + b']')
+
+
+def _encode_document_symbols(symbols: List[Dict]) -> _RawJSON:
+    """Encode parser document symbols straight to an LSP DocumentSymbol[] array"""
+    kind_of = _SYMBOL_KIND.get
+    buf = bytearray(b'[')
+    for sym in symbols:
+        if len(buf) > 1:
+            buf += b','
+        name = sym['name']
+        line = sym['line']
+        column = sym['column']
+        name_range = b'{"start":{"line":%d,"character":%d},"end":{"line":%d,"character":%d}}' % (
+            line, column, line, column + len(name))
+        buf += b'{"name":%s,"kind":%d,"range":%s,"selectionRange":%s,"detail":%s}' % (
+            _json_str(name), kind_of(sym['kind'], 13), name_range, name_range,
+            _json_str(sym.get('detail', '')))
+    buf += b']'
+    return _RawJSON(buf)
+
 
 class HALSLanguageServer:
     """LSP server for HAL/S"""
 
     def __init__(self):
-        self.parser = HALSParser()
         self.documents: Dict[str, str] = {}
+        # Document state is keyed by URI; handlers sys.intern() incoming URIs
+        # so repeated lookups hash once and compare by identity
+        # uri -> (content hash, parser holding the parse of that content)
+        self._parse_cache: 'OrderedDict[str, Tuple[bytes, HALSParser]]' = OrderedDict()
+        # (uri, version, parser) of the most recently used document
+        self._hot: Optional[Tuple[str, int, HALSParser]] = None
+        # LSP document versions: as last received, and as last parsed
+        self._doc_version: Dict[str, int] = {}
+        self._parsed_version: Dict[str, int] = {}
+        # (method, uri, line, character) -> (parser used, LSP result)
+        self._query_cache: 'OrderedDict[Tuple[str, str, int, int], Tuple[HALSParser, Any]]' = OrderedDict()
+        self._parse_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # uri -> (parser, sorted upper-case labels, completion items in the same order)
+        self._completion_index: Dict[str, Tuple[HALSParser, List[str], List[Dict]]] = {}
+        # uri -> diagnostics most recently published for it
+        self._published: Dict[str, List] = {}
+        # URIs whose text changed, consumed by the background parser thread
+        self._parse_queue: 'queue.Queue[str]' = queue.Queue()
+        self._parse_thread = threading.Thread(target=self._parse_worker,
+                                              name='hals-parser', daemon=True)
+        self._parse_thread.start()
+        self._in = sys.stdin.buffer
+        self._out = sys.stdout.buffer
         self.running = True
 
+        # Dispatch tables, built once: requests carry an id and get a
+        # response, notifications do not. A dict lookup is one hash probe
+        # whatever the method; a match statement over string literals would
+        # compare against each case in turn and needs Python 3.10
+        self._request_handlers = {
+            'initialize': self._handle_initialize,
+            'shutdown': self._handle_shutdown,
+            'textDocument/completion': self._handle_completion,
+            'textDocument/hover': self._handle_hover,
+            'textDocument/definition': self._handle_definition,
+            'textDocument/references': self._handle_references,
+            'textDocument/documentSymbol': self._handle_document_symbol,
+        }
+        self._notification_handlers = {
+            'initialized': self._handle_initialized,
+            'exit': self._handle_exit,
+            'textDocument/didOpen': self._handle_did_open,
+            'textDocument/didChange': self._handle_did_change,
+            'textDocument/didClose': self._handle_did_close,
+        }
+
     def start(self):
         """Start the language server"""
         while self.running:
@@ -39,35 +277,48 @@ class HALSLanguageServer:
 
     def _read_message(self) -> Optional[Dict]:
         """Read a JSON-RPC message from stdin"""
-        headers = {}
+        # Content-Length is the only header we act on; Content-Type is skipped
+        length = None
         while True:
-            line = sys.stdin.readline()
+            line = self._in.readline()
             if not line:
                 self.running = False
                 return None
-            line = line.strip()
-            if not line:
+            if line.startswith(b'Content-Length:'):
+                length = int(line[15:])
+            elif line in (b'\r\n', b'\n'):
                 break
-            if ':' in line:
-                key, value = line.split(':', 1)
-                headers[key.strip()] = value.strip()
 
-        if 'Content-Length' not in headers:
+        if length is None:
             return None
 
-        length = int(headers['Content-Length'])
-        content = sys.stdin.read(length)
-        return json.loads(content)
+        chunks = []
+        while length > 0:
+            chunk = self._in.read(length)
+            if not chunk:
+                self.running = False
+                return None
+            chunks.append(chunk)
+            length -= len(chunk)
+        return _json_loads(b''.join(chunks))
 
     def _send_message(self, message: Dict):
         """Send a JSON-RPC message to stdout"""
-        content = json.dumps(message)
-        header = f"Content-Length: {len(content)}\r\n\r\n"
-        sys.stdout.write(header + content)
-        sys.stdout.flush()
+        self._write_frame(_json_dumps(message))
 
-    def _send_notification(self, method: str, params: Dict):
+    def _write_frame(self, content: bytes):
+        """Write one encoded JSON-RPC message with its header"""
+        header = b"Content-Length: %d\r\n\r\n" % len(content)
+        with self._send_lock:
+            self._out.write(header + content)
+            self._out.flush()
+
+    def _send_notification(self, method: str, params: Any):
         """Send a notification"""
+        prefix = _NOTIFICATION_PREFIX.get(method)
+        if prefix is not None:
+            self._write_frame(prefix + _json_dumps(params) + b'}')
+            return
         self._send_message({
             'jsonrpc': '2.0',
             'method': method,
@@ -87,65 +338,32 @@ class HALSLanguageServer:
         msg_id = message.get('id')
         params = message.get('params', {})
 
-        handlers = {
-            'initialize': self._handle_initialize,
-            'initialized': self._handle_initialized,
-            'shutdown': self._handle_shutdown,
-            'exit': self._handle_exit,
-            'textDocument/didOpen': self._handle_did_open,
-            'textDocument/didChange': self._handle_did_change,
-            'textDocument/didClose': self._handle_did_close,
-            'textDocument/completion': self._handle_completion,
-            'textDocument/hover': self._handle_hover,
-            'textDocument/definition': self._handle_definition,
-            'textDocument/references': self._handle_references,
-            'textDocument/documentSymbol': self._handle_document_symbol,
-        }
+        if msg_id is None:
+            handler = self._notification_handlers.get(method)
+            if handler:
+                handler(params)
+            return None
 
-        handler = handlers.get(method)
+        handler = self._request_handlers.get(method)
         if handler:
-            result = handler(params)
-            if msg_id is not None:
-                return {
-                    'jsonrpc': '2.0',
-                    'id': msg_id,
-                    'result': result
-                }
-        elif msg_id is not None:
             return {
                 'jsonrpc': '2.0',
                 'id': msg_id,
-                'error': {
-                    'code': -32601,
-                    'message': f"Method not found: {method}"
-                }
+                'result': handler(params)
             }
-        return None
-
-    def _handle_initialize(self, params: Dict) -> Dict:
-        """Handle initialize request"""
         return {
-            'capabilities': {
-                'textDocumentSync': {
-                    'openClose': True,
-                    'change': 1,  # Full sync
-                    'save': {'includeText': True}
-                },
-                'completionProvider': {
-                    'triggerCharacters': ['.', ':', ' '],
-                    'resolveProvider': False
-                },
-                'hoverProvider': True,
-                'definitionProvider': True,
-                'referencesProvider': True,
-                'documentSymbolProvider': True,
-            },
-            'serverInfo': {
-                'name': 'HAL/S Language Server',
-                'version': '1.0.0'
+            'jsonrpc': '2.0',
+            'id': msg_id,
+            'error': {
+                'code': -32601,
+                'message': f"Method not found: {method}"
             }
         }
 
+    def _handle_initialize(self, params: Dict) -> Dict:
+        """Handle initialize request"""
+        return _INIT_RESULT
+
     def _handle_initialized(self, params: Dict) -> None:
         """Handle initialized notification"""
         self._log("HAL/S Language Server ready - NASA Space Shuttle flight software language")
@@ -163,98 +381,240 @@ class HALSLanguageServer:
     def _handle_did_open(self, params: Dict) -> None:
         """Handle textDocument/didOpen"""
         doc = params.get('textDocument', {})
-        uri = doc.get('uri', '')
+        uri = sys.intern(doc.get('uri', ''))
         text = doc.get('text', '')
         self.documents[uri] = text
-        self._parse_and_publish(uri, text)
+        self._set_version(uri, doc.get('version'))
+        self._parse_queue.put(uri)
         return None
 
     def _handle_did_change(self, params: Dict) -> None:
         """Handle textDocument/didChange"""
         doc = params.get('textDocument', {})
-        uri = doc.get('uri', '')
+        uri = sys.intern(doc.get('uri', ''))
         changes = params.get('contentChanges', [])
-        if changes:
-            text = changes[0].get('text', '')
+        if changes and uri in self.documents:
+            text = self.documents[uri]
+            for change in changes:
+                text = self._apply_change(text, change)
+            if text == self.documents[uri]:
+                # Byte-identical edit (e.g. an undo-stack touch): no reparse
+                self._advance_version(uri, doc.get('version'))
+                return None
             self.documents[uri] = text
-            self._parse_and_publish(uri, text)
+            self._set_version(uri, doc.get('version'))
+            self._parse_queue.put(uri)
         return None
 
     def _handle_did_close(self, params: Dict) -> None:
         """Handle textDocument/didClose"""
         doc = params.get('textDocument', {})
-        uri = doc.get('uri', '')
+        uri = sys.intern(doc.get('uri', ''))
         if uri in self.documents:
             del self.documents[uri]
+        # The parse itself stays in the LRU cache: reopening the file with
+        # the same text then hashes to a hit instead of reparsing
+        with self._cache_lock:
+            self._parsed_version.pop(uri, None)
+            if self._hot is not None and self._hot[0] is uri:
+                self._hot = None
+        for key in [k for k in self._query_cache if k[1] == uri]:
+            del self._query_cache[key]
+        self._published.pop(uri, None)
+        self._completion_index.pop(uri, None)
+        self._doc_version.pop(uri, None)
         return None
 
-    def _parse_and_publish(self, uri: str, text: str):
-        """Parse document and publish diagnostics"""
-        self.parser.parse(text)
-        diagnostics = []
-        for diag in self.parser.get_diagnostics():
-            diagnostics.append({
-                'range': {
-                    'start': {'line': diag.line, 'character': diag.column},
-                    'end': {'line': diag.line, 'character': diag.end_column}
-                },
-                'message': diag.message,
-                'severity': 1 if diag.severity == 'error' else 2
-            })
-        self._send_notification('textDocument/publishDiagnostics', {
-            'uri': uri,
-            'diagnostics': diagnostics
-        })
-
-    def _handle_completion(self, params: Dict) -> List[Dict]:
-        """Handle textDocument/completion"""
-        uri = params.get('textDocument', {}).get('uri', '')
+    def _set_version(self, uri: str, version: Optional[int]):
+        """Record the client's version for uri; call after storing its text"""
+        if version is None:
+            self._doc_version.pop(uri, None)
+        else:
+            self._doc_version[uri] = version
+
+    def _advance_version(self, uri: str, version: Optional[int]):
+        """Move an unchanged document to a new version, keeping its parse current"""
+        with self._cache_lock:
+            old = self._doc_version.get(uri)
+            was_parsed = old is not None and self._parsed_version.get(uri) == old
+            self._set_version(uri, version)
+            if was_parsed and version is not None:
+                self._parsed_version[uri] = version
+            if self._hot is not None and self._hot[0] is uri:
+                self._hot = None
+
+    def _apply_change(self, text: str, change: Dict) -> str:
+        """Apply one contentChange entry (ranged or whole-document) to text"""
+        change_range = change.get('range')
+        if change_range is None:
+            return change.get('text', '')
+        start = self._offset_at(text, change_range['start'])
+        end = self._offset_at(text, change_range['end'])
+        return text[:start] + change.get('text', '') + text[end:]
+
+    def _offset_at(self, text: str, position: Dict) -> int:
+        """Convert an LSP line/character position to an offset into text"""
+        offset = 0
+        for _ in range(position.get('line', 0)):
+            newline = text.find('\n', offset)
+            if newline < 0:
+                return len(text)
+            offset = newline + 1
+        line_end = text.find('\n', offset)
+        if line_end < 0:
+            line_end = len(text)
+        return min(offset + _line_index(text[offset:line_end], position.get('character', 0)), line_end)
+
+    def _parse_worker(self):
+        """Background thread: parse changed documents and publish diagnostics"""
+        while True:
+            pending = {self._parse_queue.get()}
+            # Keep absorbing edits until typing goes idle; each URI is then
+            # parsed once, against whatever its text is by that time
+            while True:
+                try:
+                    pending.add(self._parse_queue.get(timeout=DIAGNOSTICS_DEBOUNCE))
+                except queue.Empty:
+                    break
+            for uri in pending:
+                if uri not in self.documents:
+                    continue
+                try:
+                    self._publish_diagnostics(uri)
+                except Exception as e:
+                    self._log(f"Error: {e}")
+
+    def _ensure_parsed(self, uri: str) -> HALSParser:
+        """Return a parser for the current text of uri, parsing only if it changed"""
+        # Read the version before the text: a concurrent edit can then only
+        # make us record a stale version (forcing a rehash), never the reverse
+        version = self._doc_version.get(uri)
+        hot = self._hot
+        if hot is not None and hot[0] is uri and version is not None and hot[1] == version:
+            return hot[2]
+
+        cached = self._parse_cache.get(uri)
+        if (cached is not None and version is not None
+                and self._parsed_version.get(uri) == version):
+            return self._remember(uri, version, cached[0], cached[1])
+
+        text = self.documents.get(uri)
+        if text is None:
+            return HALSParser()
+
+        digest = _content_hash(text)
+        if cached is not None and cached[0] == digest:
+            return self._remember(uri, version, digest, cached[1])
+
+        with self._parse_lock:
+            # Another thread may have parsed this text while we waited
+            cached = self._parse_cache.get(uri)
+            if cached is not None and cached[0] == digest:
+                return self._remember(uri, version, digest, cached[1])
+            # The last parse of this document lets only the edited
+            # statements be scanned again
+            parser = HALSParser()
+            parser.parse(text, previous=cached[1] if cached is not None else None)
+            return self._remember(uri, version, digest, parser)
+
+    def _remember(self, uri: str, version: Optional[int], digest: bytes,
+                  parser: HALSParser) -> HALSParser:
+        """Record parser as the current parse of uri and mark uri most recently used"""
+        with self._cache_lock:
+            if uri not in self.documents:
+                # Closed while we were parsing
+                return parser
+            self._parse_cache[uri] = (digest, parser)
+            self._parse_cache.move_to_end(uri)
+            while len(self._parse_cache) > PARSE_CACHE_SIZE:
+                evicted, _ = self._parse_cache.popitem(last=False)
+                self._parsed_version.pop(evicted, None)
+            if version is None:
+                self._parsed_version.pop(uri, None)
+                self._hot = None
+            else:
+                self._parsed_version[uri] = version
+                self._hot = (uri, version, parser)
+        return parser
+
+    def _publish_diagnostics(self, uri: str):
+        """Publish diagnostics for uri unless they match what the client already has"""
+        parser = self._ensure_parsed(uri)
+        current = parser.get_diagnostics()
+        if self._published.get(uri) == current:
+            return
+        self._published[uri] = list(current)
+
+        # Each diagnostic is formatted straight from the parser's fields into
+        # one fixed template; with or without orjson this beats building four
+        # dicts per diagnostic just to encode them
+        self._send_notification('textDocument/publishDiagnostics', _RawJSON(
+            b'{"uri":%s,"diagnostics":%s}' % (_json_str(uri), _encode_diagnostics(current))))
+
+    def _cached_query(self, method: str, params: Dict,
+                      compute: Callable[[HALSParser, str, int, int], Any]) -> Any:
+        """Answer a positional request, reusing the last result for an unchanged parse"""
+        uri = sys.intern(params.get('textDocument', {}).get('uri', ''))
         position = params.get('position', {})
         line = position.get('line', 0)
         char = position.get('character', 0)
 
-        if uri in self.documents:
-            self.parser.parse(self.documents[uri])
-
-        completions = self.parser.get_completions(line, char)
-        result = []
-
-        kind_map = {
-            'keyword': 14,      # Keyword
-            'program': 2,       # Module
-            'procedure': 3,     # Function
-            'function': 3,      # Function
-            'task': 2,          # Module
-            'compool': 2,       # Module
-            'variable': 6,      # Variable
-            'constant': 21,     # Constant
-            'structure': 22,    # Struct
-            'label': 20,        # Reference
-            'replace': 15,      # Snippet
-            'parameter': 6,     # Variable
-        }
+        parser = self._ensure_parsed(uri)
+        # Clients count characters in UTF-16 code units; the parser indexes
+        # the line's text
+        if line < len(parser.lines):
+            char = _line_index(parser.lines[line], char)
+
+        key = (method, uri, line, char)
+        cached = self._query_cache.get(key)
+        if cached is not None and cached[0] is parser:
+            self._query_cache.move_to_end(key)
+            return cached[1]
+
+        result = compute(parser, uri, line, char)
+        self._query_cache[key] = (parser, result)
+        self._query_cache.move_to_end(key)
+        if len(self._query_cache) > QUERY_CACHE_SIZE:
+            self._query_cache.popitem(last=False)
+        return result
 
-        for c in completions:
-            result.append({
+    def _handle_completion(self, params: Dict) -> Any:
+        """Handle textDocument/completion"""
+        return self._cached_query('completion', params, self._completion)
+
+    def _completion(self, parser: HALSParser, uri: str, line: int, char: int) -> Any:
+        """Build completion items at a position, narrowed to the word being typed"""
+        index = self._completion_index.get(uri)
+        if index is None or index[0] is not parser:
+            kind_of = _COMPLETION_KIND.get
+            items = sorted(({
                 'label': c['label'],
-                'kind': kind_map.get(c['kind'], 6),
+                'kind': kind_of(c['kind'], 6),
                 'detail': c['detail'],
                 'documentation': c.get('documentation', '')
-            })
-
-        return result
+            } for c in parser.get_completions(line, char)), key=lambda item: item['label'].upper())
+            index = (parser, [item['label'].upper() for item in items], items)
+            self._completion_index[uri] = index
+        _, labels, items = index
+
+        prefix = _word_prefix(parser.lines[line], char) if line < len(parser.lines) else ''
+        if not prefix:
+            return items
+
+        # Labels sharing the prefix form one contiguous run of the sorted list.
+        # The list is incomplete: the client must ask again if the word is
+        # shortened past this prefix
+        start = bisect_left(labels, prefix)
+        end = bisect_left(labels, prefix + '\uffff', start)
+        return {'isIncomplete': True, 'items': items[start:end]}
 
     def _handle_hover(self, params: Dict) -> Optional[Dict]:
         """Handle textDocument/hover"""
-        uri = params.get('textDocument', {}).get('uri', '')
-        position = params.get('position', {})
-        line = position.get('line', 0)
-        char = position.get('character', 0)
+        return self._cached_query('hover', params, self._hover)
 
-        if uri in self.documents:
-            self.parser.parse(self.documents[uri])
-
-        hover = self.parser.get_hover(line, char)
+    def _hover(self, parser: HALSParser, uri: str, line: int, char: int) -> Optional[Dict]:
+        """Build hover contents at a position"""
+        hover = parser.get_hover(line, char)
         if hover:
             return {
                 'contents': {
@@ -266,87 +626,51 @@ class HALSLanguageServer:
 
     def _handle_definition(self, params: Dict) -> Optional[Dict]:
         """Handle textDocument/definition"""
-        uri = params.get('textDocument', {}).get('uri', '')
-        position = params.get('position', {})
-        line = position.get('line', 0)
-        char = position.get('character', 0)
+        return self._cached_query('definition', params, self._definition)
 
-        if uri in self.documents:
-            self.parser.parse(self.documents[uri])
-
-        definition = self.parser.get_definition(line, char)
+    def _definition(self, parser: HALSParser, uri: str, line: int, char: int) -> Optional[Dict]:
+        """Find the definition location for the symbol at a position"""
+        definition = parser.get_definition(line, char)
         if definition:
             return {
                 'uri': uri,
-                'range': {
-                    'start': {'line': definition['line'], 'character': definition['column']},
-                    'end': {'line': definition['line'], 'character': definition['column'] + len(definition['name'])}
-                }
+                'range': _make_range(definition['line'], definition['column'],
+                                     definition['column'] + len(definition['name']))
             }
         return None
 
     def _handle_references(self, params: Dict) -> List[Dict]:
         """Handle textDocument/references"""
-        uri = params.get('textDocument', {}).get('uri', '')
-        position = params.get('position', {})
-        line = position.get('line', 0)
-        char = position.get('character', 0)
-
-        if uri in self.documents:
-            self.parser.parse(self.documents[uri])
+        return self._cached_query('references', params, self._references)
 
-        refs = self.parser.get_references_at(line, char)
-        result = []
-        for ref in refs:
-            result.append({
-                'uri': uri,
-                'range': {
-                    'start': {'line': ref['line'], 'character': ref['column']},
-                    'end': {'line': ref['line'], 'character': ref['end_column']}
-                }
-            })
-        return result
+    def _references(self, parser: HALSParser, uri: str, line: int, char: int) -> List[Dict]:
+        """Find all references to the symbol at a position"""
+        refs = parser.get_references_at(line, char)
+        return [{
+            'uri': uri,
+            'range': _make_range(ref['line'], ref['column'], ref['end_column'])
+        } for ref in refs]
 
     def _handle_document_symbol(self, params: Dict) -> List[Dict]:
         """Handle textDocument/documentSymbol"""
-        uri = params.get('textDocument', {}).get('uri', '')
-
-        if uri in self.documents:
-            self.parser.parse(self.documents[uri])
-
-        symbols = self.parser.get_document_symbols()
-        result = []
-
-        kind_map = {
-            'program': 2,       # Module
-            'procedure': 12,    # Function
-            'function': 12,     # Function
-            'task': 2,          # Module
-            'compool': 2,       # Module
-            'variable': 13,     # Variable
-            'constant': 14,     # Constant
-            'structure': 23,    # Struct
-            'label': 20,        # Key
-            'replace': 15,      # Macro
-            'parameter': 13,    # Variable
-        }
-
-        for sym in symbols:
-            result.append({
-                'name': sym['name'],
-                'kind': kind_map.get(sym['kind'], 13),
-                'range': {
-                    'start': {'line': sym['line'], 'character': sym['column']},
-                    'end': {'line': sym['line'], 'character': sym['column'] + len(sym['name'])}
-                },
-                'selectionRange': {
-                    'start': {'line': sym['line'], 'character': sym['column']},
-                    'end': {'line': sym['line'], 'character': sym['column'] + len(sym['name'])}
-                },
-                'detail': sym.get('detail', '')
-            })
-
-        return result
+        uri = sys.intern(params.get('textDocument', {}).get('uri', ''))
+
+        parser = self._ensure_parsed(uri)
+
+        symbols = parser.get_document_symbols()
+        if orjson is None:
+            return _encode_document_symbols(symbols)
+        kind_of = _SYMBOL_KIND.get
+
+        # range and selectionRange are identical, so share one Range object
+        return [{
+            'name': sym['name'],
+            'kind': kind_of(sym['kind'], 13),
+            'range': (name_range := _make_range(sym['line'], sym['column'],
+                                                sym['column'] + len(sym['name']))),
+            'selectionRange': name_range,
+            'detail': sym.get('detail', '')
+        } for sym in symbols]
 
 
 def main():
@@ -10,11 +10,123 @@ Reference: NASA Technical Reports - HAL/S Language Specification (1974-1978)
 """
 
 import re
+import string
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import attrgetter
 from typing import List, Dict, Tuple, Optional, Set
 from dataclasses import dataclass, field
 from enum import Enum
 
 
+# Symbols and references are created in bulk; where dataclasses support
+# it (Python 3.10+), slots drop the per-instance __dict__
+_DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# Every declaration form, as (form, pattern). Forms are tried in this
+# order at each position and their matches applied in this order too; the
+# catch-all label form must stay last so unit headers win over it.
+# Parenthesised parts stop at ';' so an unclosed '(' costs at most one
+# statement of scanning, and a unit header still being typed without its
+# ')' is still recognised
+_DECLARATION_FORMS = (
+    ('program', r'\b(?P<program_name>[A-Z_][A-Z0-9_]*)\s*:\s*PROGRAM\s*;'),
+    ('procedure', r'\b(?P<procedure_name>[A-Z_][A-Z0-9_]*)\s*:\s*PROCEDURE\s*(?:\((?P<procedure_params>[^);]*)\)?)?\s*;'),
+    ('function', r'\b(?P<function_name>[A-Z_][A-Z0-9_]*)\s*:\s*(?P<function_type>INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT)?\s*FUNCTION\s*(?:\((?P<function_params>[^);]*)\)?)?\s*;'),
+    ('task', r'\b(?P<task_name>[A-Z_][A-Z0-9_]*)\s*:\s*TASK\s*;'),
+    ('compool', r'\b(?P<compool_name>[A-Z_][A-Z0-9_]*)\s*:\s*COMPOOL\s*;'),
+    ('declare', r'\bDECLARE\s+(?P<declare_name>[A-Z_][A-Z0-9_]*)\s+(?P<declare_type>INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT|EVENT)\s*(?:INITIAL\s*\([^);]*\))?\s*;'),
+    ('array', r'\bDECLARE\s+(?P<array_name>[A-Z_][A-Z0-9_]*)\s+ARRAY\s*\((?P<array_dims>[^);]+)\)\s+(?P<array_type>INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT)\s*;'),
+    ('constant', r'\bDECLARE\s+(?P<constant_name>[A-Z_][A-Z0-9_]*)\s+CONSTANT\s*\((?P<constant_value>[^);]+)\)\s*;'),
+    ('vector', r'\bDECLARE\s+(?P<vector_name>[A-Z_][A-Z0-9_]*)\s+VECTOR\s*\((?P<vector_size>\d+)\)\s*;'),
+    ('matrix', r'\bDECLARE\s+(?P<matrix_name>[A-Z_][A-Z0-9_]*)\s+MATRIX\s*\((?P<matrix_rows>\d+)\s*,\s*(?P<matrix_cols>\d+)\)\s*;'),
+    ('structure', r'\bDECLARE\s+(?P<structure_name>[A-Z_][A-Z0-9_]*)\s+STRUCTURE\s*;'),
+    ('replace', r'\bREPLACE\s+(?P<replace_name>[A-Z_][A-Z0-9_]*)\s+BY\s+"(?P<replace_text>[^"]+)"\s*;'),
+    ('label', r'\b(?P<label_name>[A-Z_][A-Z0-9_]*)\s*:(?!\s*(?:PROGRAM|PROCEDURE|FUNCTION|TASK|COMPOOL))'),
+)
+
+# HAL/S is written in ASCII; other characters are left as they are
+_ASCII_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+# Forms that begin "name:", tried together behind one colon check
+_COLON_FORMS = ('program', 'procedure', 'function', 'task', 'compool', 'label')
+
+# Patterns are compiled once at import rather than looked up in re's
+# cache on every parse. All declaration forms share one alternation, with
+# any other identifier as the final alternative, so the source is scanned
+# for declarations and references in a single pass. Every alternative
+# starts with a letter or '_', and the lookahead for that lets the engine
+# skip other positions without trying each branch; the colon check does
+# the same for the "name:" forms. This and _RE_IDENT are case-sensitive:
+# they only ever run over text passed through _upper_ascii
+_RE_SOURCE = re.compile(
+    r'(?=[A-Z_])(?:(?=[A-Z_][A-Z0-9_]*\s*:)(?:'
+    + '|'.join(f'(?P<{form}>{pattern})' for form, pattern in _DECLARATION_FORMS
+               if form in _COLON_FORMS)
+    + ')|'
+    + '|'.join(f'(?P<{form}>{pattern})' for form, pattern in _DECLARATION_FORMS
+               if form not in _COLON_FORMS)
+    + r'|(?P<ident>\b[A-Z_][A-Z0-9_]*\b))')
+# Column 1 of a HAL/S line gives its card type
+_RE_BLANK_CARD = re.compile(r'^[EeSsCc].*', re.MULTILINE)
+_RE_MAIN_CARD = re.compile(r'^[Mm]', re.MULTILINE)
+_RE_IDENT = re.compile(r'\b([A-Z_][A-Z0-9_]*)\b')
+
+
+def _upper_ascii(text: str) -> str:
+    """Uppercase ASCII letters only, so every offset stays in place"""
+    # str.upper() is fastest, but only ASCII text is sure to keep its length
+    return text.upper() if text.isascii() else text.translate(_ASCII_UPPER)
+
+
+def _source_group(match: 're.Match', group: str, text: str) -> Optional[str]:
+    """Text of a match group with the case it has in the source"""
+    start, end = match.span(group)
+    return text[start:end] if start >= 0 else None
+
+
+def _common_prefix_length(a: str, b: str, limit: int) -> int:
+    """Length of the common prefix of a and b, at most limit"""
+    # Compare in blocks, then bisect the first block that differs
+    block = 4096
+    low = 0
+    while low + block <= limit and a[low:low + block] == b[low:low + block]:
+        low += block
+    high = min(low + block, limit)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _statement_end(text: str, pos: int) -> int:
+    """First position at or after pos that follows a ';' (or the end)"""
+    end = text.find(';', pos - 1)
+    return end + 1 if end >= 0 else len(text)
+
+
+def _opens_replace_string(text: str, quote: int) -> bool:
+    """Whether the '"' at text[quote] follows 'BY ', as a REPLACE string does"""
+    by_end = quote
+    while by_end and text[by_end - 1].isspace():
+        by_end -= 1
+    return by_end < quote and by_end >= 2 and text[by_end - 2:by_end].upper() == 'BY'
+
+
+def _moved_symbol(symbol: 'Symbol', line: int, column: int) -> 'Symbol':
+    """Copy of symbol at another position"""
+    # Called for every symbol after an edit that adds or removes lines;
+    # dataclasses.replace() is several times slower than this
+    return Symbol(symbol.name, symbol.kind, symbol.data_type, line, column,
+                  symbol.end_line, symbol.end_column, symbol.scope,
+                  symbol.documentation, symbol.parameters, symbol.dimensions)
+
+
 class SymbolKind(Enum):
     """Symbol kinds for HAL/S"""
     PROGRAM = "program"
@@ -30,7 +142,7 @@ class SymbolKind(Enum):
     REPLACE = "replace"
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class Symbol:
     """A symbol in the HAL/S program"""
     name: str
@@ -46,7 +158,7 @@ class Symbol:
     dimensions: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class Reference:
     """A reference to a symbol"""
     name: str
@@ -56,7 +168,7 @@ class Reference:
     context: str = ""
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class Diagnostic:
     """A diagnostic message"""
     line: int
@@ -74,7 +186,7 @@ class HALSParser:
     """
 
     # HAL/S keywords
-    KEYWORDS = {
+    KEYWORDS = frozenset({
         # Program units
         'PROGRAM', 'PROCEDURE', 'FUNCTION', 'TASK', 'COMPOOL', 'UPDATE',
         'CLOSE', 'RETURN',
@@ -116,7 +228,15 @@ class HALSParser:
         # Vector/Matrix operations
         'TRANSPOSE', 'TRACE', 'DET', 'INVERSE', 'IDENTITY',
         'UNIT', 'ABVAL', 'DOT', 'CROSS',
-    }
+    })
+
+    # Keyword completion items never change, so they are built once
+    _KEYWORD_COMPLETIONS = tuple({
+        'label': kw,
+        'kind': 'keyword',
+        'detail': 'HAL/S keyword',
+        'documentation': f"HAL/S keyword: {kw}"
+    } for kw in sorted(KEYWORDS))
 
     # Operators
     OPERATORS = {
@@ -142,19 +262,61 @@ class HALSParser:
     }
 
     def __init__(self):
-        self.symbols: Dict[str, Symbol] = {}
-        self.references: List[Reference] = []
-        self.diagnostics: List[Diagnostic] = []
+        self._pending_text: Optional[str] = None
+        self._previous: Optional['HALSParser'] = None
+        # Comment-free text last parsed, and the declarations found in it
+        # as (start, end, form, symbol), in source order
+        self._source: Optional[str] = None
+        self._declarations: List[Tuple[int, int, str, Symbol]] = []
+        self._symbols: Dict[str, Symbol] = {}
+        self._outline: Optional[List[Dict]] = None
+        self._completions: Optional[List[Dict]] = None
+        self._line_words: Dict[int, Tuple[array, array, List[str]]] = {}
+        self._reset_references()
+        self._diagnostics: List[Diagnostic] = []
         self.lines: List[str] = []
+        self._line_starts: List[int] = [0]
         self.current_scope: str = "global"
         self.scope_stack: List[str] = ["global"]
 
-    def parse(self, text: str) -> None:
-        """Parse HAL/S source code"""
-        self.symbols = {}
-        self.references = []
-        self.diagnostics = []
+    def parse(self, text: str, previous: Optional['HALSParser'] = None) -> None:
+        """
+        Parse HAL/S source code
+
+        previous may be a parser holding an earlier version of the same
+        document; only the statements that changed since are scanned again.
+        """
+        self.stage_text(text, previous)
+        self._ensure_parsed()
+
+    def stage_text(self, text: str, previous: Optional['HALSParser'] = None) -> None:
+        """
+        Take new source text without parsing it yet.
+
+        The parse runs when a result is first read, so text replaced
+        before anyone asks about it is never parsed.
+        """
+        self._pending_text = text
+        self._previous = previous
         self.lines = text.split('\n')
+
+    def _ensure_parsed(self) -> None:
+        """Parse the staged text, if any"""
+        text = self._pending_text
+        if text is not None:
+            previous = self._previous
+            self._pending_text = self._previous = None
+            self._parse(text, previous)
+
+    def _parse(self, text: str, previous: Optional['HALSParser'] = None) -> None:
+        """Build symbols and references for text"""
+        self._symbols = {}
+        self._declarations = []
+        self._outline = None
+        self._completions = None
+        self._line_words = {}
+        self._reset_references()
+        self._diagnostics = []
         self.current_scope = "global"
         self.scope_stack = ["global"]
 
@@ -163,319 +325,556 @@ class HALSParser:
 
         # Remove comments
         cleaned_text = self._remove_comments(processed_text)
-
-        # Parse declarations and structures
-        self._parse_programs(cleaned_text)
-        self._parse_procedures(cleaned_text)
-        self._parse_functions(cleaned_text)
-        self._parse_tasks(cleaned_text)
-        self._parse_compools(cleaned_text)
-        self._parse_declares(cleaned_text)
-        self._parse_structures(cleaned_text)
-        self._parse_replaces(cleaned_text)
-        self._parse_labels(cleaned_text)
-
-        # Parse references
-        self._parse_references(cleaned_text)
+        self._index_lines(cleaned_text)
+
+        # Parse declarations, structures and references, keeping what the
+        # previous version's parse found outside the edited statements
+        if previous is None or not self._parse_changes(previous, cleaned_text):
+            self._parse_source(cleaned_text)
+        self._apply_declarations()
+        self._source = cleaned_text
+
+    def _reset_references(self) -> None:
+        """Empty the reference columns"""
+        # References are stored column-wise, one entry per occurrence;
+        # Reference objects are only built if someone asks for them. Names
+        # are interned, each occurrence holding the id of its name. The
+        # columns grow by append: presizing them from the text length and
+        # writing by index was measured slower, as index writes cost more
+        # per element than the amortised reallocations they save
+        self._name_ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        # Names known to be in use when _names was last built from scratch;
+        # incremental parses only ever add names, so this bounds the dead ones
+        self._live_names = 0
+        self._ref_name_ids = array('I')
+        self._ref_lines = array('i')
+        self._ref_columns = array('i')
+        self._ref_end_columns = array('i')
+        self._references: Optional[List[Reference]] = None
+        self._refs_by_name: Optional[List[List[int]]] = None
+
+    @property
+    def symbols(self) -> Dict[str, Symbol]:
+        """Declared symbols by name"""
+        self._ensure_parsed()
+        return self._symbols
+
+    @property
+    def diagnostics(self) -> List[Diagnostic]:
+        """Problems found in the source"""
+        self._ensure_parsed()
+        return self._diagnostics
+
+    @property
+    def references(self) -> List[Reference]:
+        """All identifier references, in source order"""
+        self._ensure_parsed()
+        if self._references is None:
+            names = self._names
+            self._references = [
+                Reference(name=names[name_id], line=line, column=column, end_column=end_column)
+                for name_id, line, column, end_column in zip(
+                    self._ref_name_ids, self._ref_lines,
+                    self._ref_columns, self._ref_end_columns)
+            ]
+        return self._references
 
     def _preprocess_multiline(self, text: str) -> str:
         """
         Preprocess HAL/S multi-line format.
         E = exponent line, S = subscript line, M = main line
-        """
-        lines = text.split('\n')
-        result_lines = []
-
-        for line in lines:
-            if line and len(line) > 0:
-                first_char = line[0].upper()
-                if first_char in ('E', 'S'):
-                    # Skip exponent/subscript lines for now (simplified parsing)
-                    continue
-                elif first_char == 'M':
-                    # Main line - strip the M prefix
-                    result_lines.append(line[1:] if len(line) > 1 else '')
-                elif first_char == 'C':
-                    # Comment line
-                    result_lines.append('/*' + line[1:] + '*/')
-                else:
-                    result_lines.append(line)
-            else:
-                result_lines.append(line)
 
-        return '\n'.join(result_lines)
+        Every line stays where it was, so positions in the result are
+        positions in the source.
+        """
+        # Exponent/subscript lines are skipped for now (simplified parsing)
+        # and comment lines carry nothing to parse, so both become empty
+        text = _RE_BLANK_CARD.sub('', text)
+        # Main line - blank the M prefix
+        return _RE_MAIN_CARD.sub(' ', text)
 
     def _remove_comments(self, text: str) -> str:
-        """Remove HAL/S comments: /* ... */ and C in column 1"""
-        # Remove block comments
-        text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
-        return text
+        """
+        Blank out HAL/S comments: /* ... */ and C in column 1.
 
-    def _find_position(self, text: str, match_start: int) -> Tuple[int, int]:
+        Comment characters become spaces and their newlines are kept, so
+        every line and column after a comment still matches the source.
+        """
+        parts = []
+        find = text.find
+        pos = 0
+        while True:
+            start = find('/*', pos)
+            if start < 0:
+                break
+            end = find('*/', start + 2)
+            if end < 0:
+                # Unterminated comment - leave the rest of the text alone
+                break
+            end += 2
+            parts.append(text[pos:start])
+            parts.append('\n'.join(' ' * len(line) for line in text[start:end].split('\n')))
+            pos = end
+        if not parts:
+            return text
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def _index_lines(self, text: str) -> None:
+        """Record the offset each line of the scanned text starts at"""
+        self._line_starts = [0]
+        self._line_starts.extend(accumulate(len(line) + 1 for line in text.split('\n')[:-1]))
+
+    def _find_position(self, match_start: int) -> Tuple[int, int]:
         """Convert character offset to line and column"""
-        line = text[:match_start].count('\n')
-        last_newline = text.rfind('\n', 0, match_start)
-        column = match_start - last_newline - 1 if last_newline >= 0 else match_start
-        return (line, column)
-
-    def _parse_programs(self, text: str) -> None:
-        """Parse PROGRAM declarations: label: PROGRAM;"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:\s*PROGRAM\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.PROGRAM,
-                data_type="PROGRAM",
-                line=line,
-                column=col,
-                documentation=f"HAL/S Program unit"
-            )
-
-    def _parse_procedures(self, text: str) -> None:
-        """Parse PROCEDURE declarations"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:\s*PROCEDURE\s*(?:\(([^)]*)\))?\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            params_text = match.group(2)
-            line, col = self._find_position(text, match.start())
-
-            params = []
-            if params_text:
-                params = [p.strip() for p in params_text.split(',')]
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.PROCEDURE,
-                data_type="PROCEDURE",
-                line=line,
-                column=col,
-                parameters=params,
-                documentation=f"Procedure with {len(params)} parameters" if params else "Procedure"
-            )
-
-    def _parse_functions(self, text: str) -> None:
-        """Parse FUNCTION declarations with return type"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:\s*(INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT)?\s*FUNCTION\s*(?:\(([^)]*)\))?\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            return_type = match.group(2) or "SCALAR"
-            params_text = match.group(3)
-            line, col = self._find_position(text, match.start())
-
-            params = []
-            if params_text:
-                params = [p.strip() for p in params_text.split(',')]
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.FUNCTION,
-                data_type=f"{return_type.upper()} FUNCTION",
-                line=line,
-                column=col,
-                parameters=params,
-                documentation=f"Function returning {return_type.upper()}"
-            )
-
-    def _parse_tasks(self, text: str) -> None:
-        """Parse TASK declarations (real-time processes)"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:\s*TASK\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.TASK,
-                data_type="TASK",
-                line=line,
-                column=col,
-                documentation="Real-time task (schedulable process)"
-            )
-
-    def _parse_compools(self, text: str) -> None:
-        """Parse COMPOOL declarations (shared data pools)"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:\s*COMPOOL\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.COMPOOL,
-                data_type="COMPOOL",
-                line=line,
-                column=col,
-                documentation="Communication pool (shared data)"
-            )
-
-    def _parse_declares(self, text: str) -> None:
+        line = bisect_right(self._line_starts, match_start) - 1
+        return (line, match_start - self._line_starts[line])
+
+    def _parse_source(self, text: str) -> None:
+        """Parse declarations and identifier references in a single scan"""
+        # Scan an uppercased copy so names come out ready for the keyword
+        # check; handlers still take display text from the original
+        self._scan_source(text, _upper_ascii(text), bytearray(len(text)), 0, len(text))
+        self._live_names = len(self._names)
+
+    def _parse_changes(self, previous: 'HALSParser', text: str) -> bool:
         """
-        Parse DECLARE statements:
-        DECLARE name type;
-        DECLARE name ARRAY(dims) type;
-        DECLARE name CONSTANT(value);
-        DECLARE name type INITIAL(value);
+        Parse text by rescanning only the statements an edit touched.
+
+        The edit is found by comparing text with the comment-free text
+        previous parsed. Scanning starts after the last ';' before the edit
+        and stops at a ';' after it: no form reads across a ';' except a
+        REPLACE string, whose statement is scanned whole if it could run
+        across the start, so the statements outside cannot match differently,
+        and previous's results for them are reused, moved to their new
+        positions. Returns False, having changed nothing, when the edit
+        needs a full parse instead.
         """
-        # Simple declarations
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+(INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT|EVENT)\s*(?:INITIAL\s*\([^)]*\))?\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            data_type = match.group(2).upper()
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.VARIABLE,
-                data_type=data_type,
-                line=line,
-                column=col,
-                documentation=f"{data_type} variable"
-            )
-
-        # Array declarations
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+ARRAY\s*\(([^)]+)\)\s+(INTEGER|SCALAR|VECTOR|MATRIX|BOOLEAN|CHARACTER|BIT)\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            dims = match.group(2)
-            data_type = match.group(3).upper()
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.VARIABLE,
-                data_type=f"ARRAY({dims}) {data_type}",
-                line=line,
-                column=col,
-                dimensions=[d.strip() for d in dims.split(',')],
-                documentation=f"Array of {data_type} with dimensions ({dims})"
-            )
-
-        # Constants
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+CONSTANT\s*\(([^)]+)\)\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            value = match.group(2)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.CONSTANT,
-                data_type="CONSTANT",
-                line=line,
-                column=col,
-                documentation=f"Constant = {value}"
-            )
-
-        # Vector declarations with size
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+VECTOR\s*\((\d+)\)\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            size = match.group(2)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.VARIABLE,
-                data_type=f"VECTOR({size})",
-                line=line,
-                column=col,
-                dimensions=[size],
-                documentation=f"Vector of {size} elements"
-            )
-
-        # Matrix declarations
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+MATRIX\s*\((\d+)\s*,\s*(\d+)\)\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            rows = match.group(2)
-            cols = match.group(3)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.VARIABLE,
-                data_type=f"MATRIX({rows},{cols})",
-                line=line,
-                column=col,
-                dimensions=[rows, cols],
-                documentation=f"Matrix of {rows}x{cols} elements"
-            )
-
-    def _parse_structures(self, text: str) -> None:
-        """Parse STRUCTURE declarations"""
-        pattern = r'\bDECLARE\s+([A-Z_][A-Z0-9_]*)\s+STRUCTURE\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.STRUCTURE,
-                data_type="STRUCTURE",
-                line=line,
-                column=col,
-                documentation="Structure type"
-            )
-
-    def _parse_replaces(self, text: str) -> None:
-        """Parse REPLACE macro definitions"""
-        pattern = r'\bREPLACE\s+([A-Z_][A-Z0-9_]*)\s+BY\s+"([^"]+)"\s*;'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            replacement = match.group(2)
-            line, col = self._find_position(text, match.start())
-
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.REPLACE,
-                data_type="REPLACE",
-                line=line,
-                column=col,
-                documentation=f"Macro expanding to: {replacement}"
-            )
-
-    def _parse_labels(self, text: str) -> None:
-        """Parse statement labels (identifier followed by colon)"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\s*:'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            # Skip if it's a program unit keyword following the colon
-            after = text[match.end():match.end()+20].strip().upper()
-            if after.startswith(('PROGRAM', 'PROCEDURE', 'FUNCTION', 'TASK', 'COMPOOL')):
-                continue
-
-            # Skip if already defined as something else
-            if name.upper() in self.symbols:
+        previous._ensure_parsed()
+        old_text = previous._source
+        if old_text is None:
+            return False
+
+        delta = len(text) - len(old_text)
+        limit = min(len(text), len(old_text))
+        head = _common_prefix_length(text, old_text, limit)
+        tail = _common_prefix_length(text[::-1], old_text[::-1], limit - head)
+        changed_end = len(text) - tail
+        # An added or removed quote moves the end of every REPLACE string
+        # that follows, whichever statement it is in
+        if '"' in text[head:changed_end] or '"' in old_text[head:len(old_text) - tail]:
+            return False
+
+        old_declarations = previous._declarations
+        start = text.rfind(';', 0, head) + 1
+        while True:
+            spanning = [s for s, e, _, _ in old_declarations if s < start < e]
+            if spanning:
+                start = text.rfind(';', 0, min(spanning)) + 1
                 continue
-
-            line, col = self._find_position(text, match.start())
-            self.symbols[name.upper()] = Symbol(
-                name=name.upper(),
-                kind=SymbolKind.LABEL,
-                data_type="LABEL",
-                line=line,
-                column=col,
-                documentation="Statement label (GO TO target)"
-            )
-
-    def _parse_references(self, text: str) -> None:
-        """Parse all identifier references"""
-        pattern = r'\b([A-Z_][A-Z0-9_]*)\b'
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            name = match.group(1)
-            if name.upper() in self.KEYWORDS:
+            # A REPLACE string may hold a ';'. If one could be open across
+            # start, it may only match now the edit has finished it, so
+            # scan from its statement
+            quote = text.rfind('"', 0, start)
+            if quote >= 0 and _opens_replace_string(text, quote) and text.find('"', start) >= 0:
+                start = text.rfind(';', 0, quote) + 1
                 continue
+            break
+
+        # Everything before start is as previous found it
+        self._name_ids = dict(previous._name_ids)
+        self._names = list(previous._names)
+        self._live_names = previous._live_names
+        index = previous._ref_index(start)
+        self._ref_name_ids = previous._ref_name_ids[:index]
+        self._ref_lines = previous._ref_lines[:index]
+        self._ref_columns = previous._ref_columns[:index]
+        self._ref_end_columns = previous._ref_end_columns[:index]
+        declarations = self._declarations
+        declarations.extend(d for d in old_declarations if d[0] < start)
+
+        scanned = _upper_ascii(text)
+        claimed = bytearray(len(text))
+        pos = start
+        stop = _statement_end(text, changed_end + 1)
+        while True:
+            stop, pos = self._scan_source(text, scanned, claimed, pos, stop)
+            # A declaration in the old text may also run across the stop
+            old_stop = stop - delta
+            spanning = [e for s, e, _, _ in old_declarations if s < old_stop < e]
+            if not spanning:
+                break
+            stop = _statement_end(text, max(spanning) + delta)
+
+        # Everything from stop on is as previous found it from old_stop,
+        # moved by the lines and, on the stop's own line, columns the edit
+        # added or removed
+        old_line, old_column = previous._find_position(old_stop)
+        new_line, new_column = self._find_position(stop)
+        line_shift = new_line - old_line
+        column_shift = new_column - old_column
+
+        index = previous._ref_index(old_stop)
+        lines = previous._ref_lines
+        same_line = bisect_right(lines, old_line, index)
+        self._ref_name_ids.extend(previous._ref_name_ids[index:])
+        if line_shift:
+            self._ref_lines.extend([line + line_shift for line in lines[index:]])
+        else:
+            self._ref_lines.extend(lines[index:])
+        for columns, old_columns in ((self._ref_columns, previous._ref_columns),
+                                     (self._ref_end_columns, previous._ref_end_columns)):
+            if column_shift:
+                columns.extend([column + column_shift for column in old_columns[index:same_line]])
+            else:
+                columns.extend(old_columns[index:same_line])
+            columns.extend(old_columns[same_line:])
+
+        for s, e, form, symbol in old_declarations:
+            if s >= old_stop:
+                if symbol.line == old_line:
+                    symbol = _moved_symbol(symbol, new_line, symbol.column + column_shift)
+                elif line_shift:
+                    symbol = _moved_symbol(symbol, symbol.line + line_shift, symbol.column)
+                declarations.append((s + delta, e + delta, form, symbol))
+
+        # Every prefix of a name being typed gets interned; drop the ones
+        # no longer referenced once they outnumber those in use
+        if len(self._names) > 2 * self._live_names + 256:
+            self._compact_names()
+        return True
+
+    def _compact_names(self) -> None:
+        """Renumber the interned names, keeping only those referenced"""
+        names = self._names
+        live = sorted(set(self._ref_name_ids))
+        new_ids = array('I', bytes(4 * len(names)))
+        for new_id, old_id in enumerate(live):
+            new_ids[old_id] = new_id
+        self._ref_name_ids = array('I', map(new_ids.__getitem__, self._ref_name_ids))
+        self._names = [names[old_id] for old_id in live]
+        self._name_ids = {name: name_id for name_id, name in enumerate(self._names)}
+        self._live_names = len(live)
+
+    def _scan_source(self, text: str, scanned: str, claimed: bytearray,
+                     pos: int, stop: int) -> Tuple[int, int]:
+        """
+        Record the declarations and references that start in pos..stop.
+
+        scanned is text uppercased. Scanning resumes just past each
+        declared name rather than the end of its match, so a form nested
+        inside another's span (e.g. a label in a REPLACE string) is still
+        seen; claimed marks text already covered by a declaration, since a
+        "name:" inside one (a REPLACE string, a parameter list) is not a
+        label. Every identifier is recorded as a reference in source order,
+        declared names included. stop is moved past any declaration that
+        runs across it; returns the final stop and where the first match at
+        or after it starts.
+        """
+        keywords = self.KEYWORDS
+        handlers = self._FORM_HANDLERS
+        add_declaration = self._declarations.append
+        name_ids = self._name_ids
+        names = self._names
+        add_name_id = self._ref_name_ids.append
+        add_line = self._ref_lines.append
+        add_column = self._ref_columns.append
+        add_end_column = self._ref_end_columns.append
+
+        search = _RE_SOURCE.search
+        match = search(scanned, pos)
+        while match:
+            form = match.lastgroup
+            if form == 'ident':
+                start, end = match.span()
+                if start >= stop:
+                    break
+            else:
+                match_start, match_end = match.span()
+                if match_start >= stop:
+                    break
+                if form != 'label':
+                    claimed[match_start:match_end] = b'\x01' * (match_end - match_start)
+                    add_declaration((match_start, match_end, form, handlers[form](self, match, text)))
+                    if match_end > stop:
+                        stop = _statement_end(text, match_end)
+                elif not claimed[match_start]:
+                    add_declaration((match_start, match_end, form, handlers[form](self, match, text)))
+                start, end = match.span(form + '_name')
+
+            name = scanned[start:end]
+            if name not in keywords:
+                name_id = name_ids.get(name)
+                if name_id is None:
+                    name_id = name_ids[name] = len(names)
+                    names.append(name)
+
+                line, col = self._find_position(start)
+                add_name_id(name_id)
+                add_line(line)
+                add_column(col)
+                add_end_column(col + end - start)
+
+            match = search(scanned, end)
+
+        return stop, (match.start() if match else len(text))
+
+    def _apply_declarations(self) -> None:
+        """
+        Build the symbol table from the declarations found.
 
-            line, col = self._find_position(text, match.start())
-            self.references.append(Reference(
-                name=name.upper(),
-                line=line,
-                column=col,
-                end_column=col + len(name)
-            ))
+        Declarations are applied by form in a fixed order (program units,
+        then DECLAREs, structures, REPLACEs and finally labels), so a name
+        matched by more than one form resolves the same way regardless of
+        where it appears in the file. A label never replaces a symbol of
+        another kind.
+        """
+        buckets: Dict[str, List[Symbol]] = {form: [] for form, _ in _DECLARATION_FORMS}
+        for _, _, form, symbol in self._declarations:
+            buckets[form].append(symbol)
+
+        symbols = self._symbols
+        for form, _ in _DECLARATION_FORMS:
+            if form == 'label':
+                for symbol in buckets[form]:
+                    symbols.setdefault(symbol.name, symbol)
+            else:
+                for symbol in buckets[form]:
+                    symbols[symbol.name] = symbol
+
+    def _ref_index(self, offset: int) -> int:
+        """Index of the first reference at or after a text offset"""
+        line, column = self._find_position(offset)
+        lines = self._ref_lines
+        columns = self._ref_columns
+        count = len(lines)
+        index = bisect_left(lines, line)
+        while index < count and lines[index] == line and columns[index] < column:
+            index += 1
+        return index
+
+    def _make_program(self, match: 're.Match', text: str) -> Symbol:
+        """PROGRAM declarations: label: PROGRAM;"""
+        name = match.group('program_name')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.PROGRAM,
+            data_type="PROGRAM",
+            line=line,
+            column=col,
+            documentation=f"HAL/S Program unit"
+        )
+
+    def _make_procedure(self, match: 're.Match', text: str) -> Symbol:
+        """PROCEDURE declarations"""
+        name = match.group('procedure_name')
+        params_text = _source_group(match, 'procedure_params', text)
+        line, col = self._find_position(match.start())
+
+        params = []
+        if params_text:
+            params = [p.strip() for p in params_text.split(',')]
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.PROCEDURE,
+            data_type="PROCEDURE",
+            line=line,
+            column=col,
+            parameters=params,
+            documentation=f"Procedure with {len(params)} parameters" if params else "Procedure"
+        )
+
+    def _make_function(self, match: 're.Match', text: str) -> Symbol:
+        """FUNCTION declarations with return type"""
+        name = match.group('function_name')
+        return_type = match.group('function_type') or "SCALAR"
+        params_text = _source_group(match, 'function_params', text)
+        line, col = self._find_position(match.start())
+
+        params = []
+        if params_text:
+            params = [p.strip() for p in params_text.split(',')]
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.FUNCTION,
+            data_type=f"{return_type} FUNCTION",
+            line=line,
+            column=col,
+            parameters=params,
+            documentation=f"Function returning {return_type}"
+        )
+
+    def _make_task(self, match: 're.Match', text: str) -> Symbol:
+        """TASK declarations (real-time processes)"""
+        name = match.group('task_name')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.TASK,
+            data_type="TASK",
+            line=line,
+            column=col,
+            documentation="Real-time task (schedulable process)"
+        )
+
+    def _make_compool(self, match: 're.Match', text: str) -> Symbol:
+        """COMPOOL declarations (shared data pools)"""
+        name = match.group('compool_name')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.COMPOOL,
+            data_type="COMPOOL",
+            line=line,
+            column=col,
+            documentation="Communication pool (shared data)"
+        )
+
+    def _make_declare(self, match: 're.Match', text: str) -> Symbol:
+        """DECLARE name type; / DECLARE name type INITIAL(value);"""
+        name = match.group('declare_name')
+        data_type = match.group('declare_type')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.VARIABLE,
+            data_type=data_type,
+            line=line,
+            column=col,
+            documentation=f"{data_type} variable"
+        )
+
+    def _make_array(self, match: 're.Match', text: str) -> Symbol:
+        """DECLARE name ARRAY(dims) type;"""
+        name = match.group('array_name')
+        dims = _source_group(match, 'array_dims', text)
+        data_type = match.group('array_type')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.VARIABLE,
+            data_type=f"ARRAY({dims}) {data_type}",
+            line=line,
+            column=col,
+            dimensions=[d.strip() for d in dims.split(',')],
+            documentation=f"Array of {data_type} with dimensions ({dims})"
+        )
+
+    def _make_constant(self, match: 're.Match', text: str) -> Symbol:
+        """DECLARE name CONSTANT(value);"""
+        name = match.group('constant_name')
+        value = _source_group(match, 'constant_value', text)
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.CONSTANT,
+            data_type="CONSTANT",
+            line=line,
+            column=col,
+            documentation=f"Constant = {value}"
+        )
+
+    def _make_vector(self, match: 're.Match', text: str) -> Symbol:
+        """DECLARE name VECTOR(size);"""
+        name = match.group('vector_name')
+        size = match.group('vector_size')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.VARIABLE,
+            data_type=f"VECTOR({size})",
+            line=line,
+            column=col,
+            dimensions=[size],
+            documentation=f"Vector of {size} elements"
+        )
+
+    def _make_matrix(self, match: 're.Match', text: str) -> Symbol:
+        """DECLARE name MATRIX(rows, cols);"""
+        name = match.group('matrix_name')
+        rows = match.group('matrix_rows')
+        cols = match.group('matrix_cols')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.VARIABLE,
+            data_type=f"MATRIX({rows},{cols})",
+            line=line,
+            column=col,
+            dimensions=[rows, cols],
+            documentation=f"Matrix of {rows}x{cols} elements"
+        )
+
+    def _make_structure(self, match: 're.Match', text: str) -> Symbol:
+        """STRUCTURE declarations"""
+        name = match.group('structure_name')
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.STRUCTURE,
+            data_type="STRUCTURE",
+            line=line,
+            column=col,
+            documentation="Structure type"
+        )
+
+    def _make_replace(self, match: 're.Match', text: str) -> Symbol:
+        """REPLACE macro definitions"""
+        name = match.group('replace_name')
+        replacement = _source_group(match, 'replace_text', text)
+        line, col = self._find_position(match.start())
+
+        return Symbol(
+            name=name,
+            kind=SymbolKind.REPLACE,
+            data_type="REPLACE",
+            line=line,
+            column=col,
+            documentation=f"Macro expanding to: {replacement}"
+        )
+
+    def _make_label(self, match: 're.Match', text: str) -> Symbol:
+        """Statement labels (identifier followed by colon)"""
+        name = match.group('label_name')
+        line, col = self._find_position(match.start())
+        return Symbol(
+            name=name,
+            kind=SymbolKind.LABEL,
+            data_type="LABEL",
+            line=line,
+            column=col,
+            documentation="Statement label (GO TO target)"
+        )
+
+    # Declaration form (alternative name in _RE_SOURCE) -> handler
+    _FORM_HANDLERS = {
+        'program': _make_program,
+        'procedure': _make_procedure,
+        'function': _make_function,
+        'task': _make_task,
+        'compool': _make_compool,
+        'declare': _make_declare,
+        'array': _make_array,
+        'constant': _make_constant,
+        'vector': _make_vector,
+        'matrix': _make_matrix,
+        'structure': _make_structure,
+        'replace': _make_replace,
+        'label': _make_label,
+    }
 
     def get_symbols(self) -> Dict[str, Symbol]:
         """Get all parsed symbols"""
@@ -491,19 +890,16 @@ class HALSParser:
 
     def get_completions(self, line: int, column: int) -> List[Dict]:
         """Get completion items at position"""
-        completions = []
+        self._ensure_parsed()
+        # The items don't depend on the position and only change on parse()
+        if self._completions is not None:
+            return self._completions
 
         # Add keywords
-        for kw in sorted(self.KEYWORDS):
-            completions.append({
-                'label': kw,
-                'kind': 'keyword',
-                'detail': 'HAL/S keyword',
-                'documentation': f"HAL/S keyword: {kw}"
-            })
+        completions = list(self._KEYWORD_COMPLETIONS)
 
         # Add symbols
-        for name, sym in self.symbols.items():
+        for name, sym in self._symbols.items():
             completions.append({
                 'label': sym.name,
                 'kind': sym.kind.value,
@@ -511,90 +907,103 @@ class HALSParser:
                 'documentation': sym.documentation
             })
 
+        self._completions = completions
         return completions
 
-    def get_hover(self, line: int, column: int) -> Optional[Dict]:
-        """Get hover information at position"""
+    def _word_at(self, line: int, column: int) -> Optional[str]:
+        """Find the (uppercased) word at a position, if any"""
         if line >= len(self.lines):
             return None
 
-        line_text = self.lines[line]
+        # Word boundaries for a line are found once and then reused
+        index = self._line_words.get(line)
+        if index is None:
+            starts, ends, words = array('i'), array('i'), []
+            for match in _RE_IDENT.finditer(_upper_ascii(self.lines[line])):
+                starts.append(match.start())
+                ends.append(match.end())
+                words.append(match.group(1))
+            index = self._line_words[line] = (starts, ends, words)
+
+        # Words never touch, so only the last one starting at or before
+        # the column can contain it
+        starts, ends, words = index
+        i = bisect_right(starts, column) - 1
+        if i >= 0 and column <= ends[i]:
+            return words[i]
+        return None
 
+    def get_hover(self, line: int, column: int) -> Optional[Dict]:
+        """Get hover information at position"""
+        self._ensure_parsed()
         # Find the word at this position
-        for match in re.finditer(r'\b([A-Z_][A-Z0-9_]*)\b', line_text, re.IGNORECASE):
-            if match.start() <= column <= match.end():
-                word = match.group(1).upper()
+        word = self._word_at(line, column)
+        if word is None:
+            return None
 
-                if word in self.KEYWORDS:
-                    return {'contents': f"**{word}**\n\nHAL/S keyword"}
+        if word in self.KEYWORDS:
+            return {'contents': f"**{word}**\n\nHAL/S keyword"}
 
-                if word in self.symbols:
-                    sym = self.symbols[word]
-                    return {'contents': f"**{sym.name}**: {sym.data_type}\n\n{sym.documentation}"}
-                break
+        if word in self._symbols:
+            sym = self._symbols[word]
+            return {'contents': f"**{sym.name}**: {sym.data_type}\n\n{sym.documentation}"}
 
         return None
 
     def get_definition(self, line: int, column: int) -> Optional[Dict]:
         """Get definition location for symbol at position"""
-        if line >= len(self.lines):
-            return None
-
-        line_text = self.lines[line]
-
-        for match in re.finditer(r'\b([A-Z_][A-Z0-9_]*)\b', line_text, re.IGNORECASE):
-            if match.start() <= column <= match.end():
-                word = match.group(1).upper()
-                if word in self.symbols:
-                    sym = self.symbols[word]
-                    return {
-                        'line': sym.line,
-                        'column': sym.column,
-                        'name': sym.name
-                    }
-                break
+        self._ensure_parsed()
+        word = self._word_at(line, column)
+        if word in self._symbols:
+            sym = self._symbols[word]
+            return {
+                'line': sym.line,
+                'column': sym.column,
+                'name': sym.name
+            }
 
         return None
 
     def get_references_at(self, line: int, column: int) -> List[Dict]:
         """Get all references to symbol at position"""
-        if line >= len(self.lines):
-            return []
-
-        line_text = self.lines[line]
-        target_word = None
-
-        for match in re.finditer(r'\b([A-Z_][A-Z0-9_]*)\b', line_text, re.IGNORECASE):
-            if match.start() <= column <= match.end():
-                target_word = match.group(1).upper()
-                break
-
+        self._ensure_parsed()
+        target_word = self._word_at(line, column)
         if not target_word:
             return []
 
-        refs = []
-        for ref in self.references:
-            if ref.name == target_word:
-                refs.append({
-                    'line': ref.line,
-                    'column': ref.column,
-                    'end_column': ref.end_column
-                })
+        name_id = self._name_ids.get(target_word)
+        if name_id is None:
+            return []
 
-        return refs
+        # Occurrences of each name, indexed on the first lookup after a parse
+        if self._refs_by_name is None:
+            refs_by_name: List[List[int]] = [[] for _ in self._names]
+            for i, occurrence_id in enumerate(self._ref_name_ids):
+                refs_by_name[occurrence_id].append(i)
+            self._refs_by_name = refs_by_name
+
+        lines = self._ref_lines
+        columns = self._ref_columns
+        end_columns = self._ref_end_columns
+        return [{
+            'line': lines[i],
+            'column': columns[i],
+            'end_column': end_columns[i]
+        } for i in self._refs_by_name[name_id]]
 
     def get_document_symbols(self) -> List[Dict]:
         """Get all document symbols for outline"""
-        symbols = []
-        for name, sym in self.symbols.items():
-            symbols.append({
+        self._ensure_parsed()
+        # Symbols only change on parse(), so the outline is built once
+        if self._outline is None:
+            self._outline = [{
                 'name': sym.name,
                 'kind': sym.kind.value,
                 'detail': sym.data_type,
                 'line': sym.line,
                 'column': sym.column
-            })
-        return sorted(symbols, key=lambda x: x['line'])
+            } for sym in sorted(self._symbols.values(), key=attrgetter('line'))]
+        return self._outline
 
 
 def main():
@@ -0,0 +1,81 @@
+"""
+Checks that parsing an edit against the previous version of a document
+gives the same results as parsing the new text from scratch.
+
+Run with: python -m unittest test_hals_semantic_parser
+"""
+
+import unittest
+
+from hals_semantic_parser import HALSParser
+
+
+SAMPLE = '''NAV: PROGRAM;
+   DECLARE SPEED SCALAR;
+   DECLARE POS VECTOR(3);
+   DECLARE COUNT INTEGER INITIAL(0);
+   REPLACE LIMIT BY "SPEED; LOOP: 100";
+   /* wait for
+      the next cycle; LATER: */
+   TICK: PROCEDURE(DT);
+      SPEED = SPEED + DT;
+   CLOSE TICK;
+LOOP:
+   IF SPEED > LIMIT THEN GO TO LOOP;
+   COUNT = COUNT + 1;
+CLOSE NAV;
+'''
+
+
+def _results(parser):
+    """Everything a parse produces, in comparable form"""
+    symbols = sorted(
+        (name, s.kind.value, s.data_type, s.line, s.column, s.documentation,
+         list(s.parameters), list(s.dimensions))
+        for name, s in parser.get_symbols().items())
+    references = [(r.name, r.line, r.column, r.end_column) for r in parser.get_references()]
+    return symbols, references, parser.get_document_symbols()
+
+
+class IncrementalParseTest(unittest.TestCase):
+
+    def assert_edit_matches_full_parse(self, old_text, new_text):
+        previous = HALSParser()
+        previous.parse(old_text)
+        incremental = HALSParser()
+        incremental.parse(new_text, previous=previous)
+        full = HALSParser()
+        full.parse(new_text)
+        self.assertEqual(_results(incremental), _results(full), repr(new_text))
+        return incremental
+
+    def test_finishing_replace_with_semicolon_in_string(self):
+        parser = self.assert_edit_matches_full_parse(
+            'REPLACE R BY "A; B"\n', 'REPLACE R BY "A; B";\n')
+        self.assertEqual(parser.get_symbols()['R'].kind.value, 'replace')
+
+    def test_label_inside_finished_replace_string(self):
+        parser = self.assert_edit_matches_full_parse(
+            'REPLACE R BY "X; L: Y" Q;\n', 'REPLACE R BY "X; L: Y";\n')
+        self.assertIn('R', parser.get_symbols())
+        self.assertNotIn('L', parser.get_symbols())
+
+    def test_typing_and_deleting(self):
+        # Type SAMPLE one character at a time, then delete it again from
+        # the middle, each step parsed against the one before
+        previous = HALSParser()
+        previous.parse('')
+        steps = [SAMPLE[:end] for end in range(1, len(SAMPLE) + 1)]
+        middle = len(SAMPLE) // 2
+        steps += [SAMPLE[:middle - count] + SAMPLE[middle:] for count in range(1, middle + 1)]
+        for text in steps:
+            parser = HALSParser()
+            parser.parse(text, previous=previous)
+            full = HALSParser()
+            full.parse(text)
+            self.assertEqual(_results(parser), _results(full), repr(text))
+            previous = parser
+
+
+if __name__ == '__main__':
+    unittest.main()